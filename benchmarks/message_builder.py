@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark: CPU time to build a message
+
+Compares building an EmailMessage and flattening it the way
+smtplib.send_message does with bote's MessageBuilder.
+
+Run from the repository root:
+python -m benchmarks.message_builder
+~~~~~~~~~~~~~~~~~~~~~
+Source: https://github.com/RuedigerVoigt/bote
+(c) 2020-2021 Rüdiger Voigt
+Released under the Apache License 2.0
+"""
+
+from email.generator import BytesGenerator
+from email.message import EmailMessage
+import io
+import timeit
+
+from bote import message
+
+SENDER = 'bar@example.com'
+RECIPIENT = 'foo@example.com'
+SUBJECT = 'Crawler finished'
+TEXT = 'The crawler finished its job.\nNo errors occured.\n' * 5
+NUMBER = 10000
+
+
+def emailmessage_path() -> bytes:
+    "What send_mail did before: EmailMessage and send_message."
+    msg = EmailMessage()
+    msg.set_content(TEXT)
+    msg['Subject'] = SUBJECT
+    msg['From'] = SENDER
+    msg['To'] = RECIPIENT
+    with io.BytesIO() as bytesmsg:
+        generator = BytesGenerator(
+            bytesmsg, policy=msg.policy.clone(linesep='\r\n'))
+        generator.flatten(msg, linesep='\r\n')
+        return bytesmsg.getvalue()
+
+
+BUILDER = message.MessageBuilder(SENDER, {'default': RECIPIENT})
+
+
+def builder_path() -> bytes:
+    "Pre-encoded headers."
+    return BUILDER.build(RECIPIENT, SUBJECT, TEXT)
+
+
+if __name__ == "__main__":
+    for name, function in (('EmailMessage', emailmessage_path),
+                           ('MessageBuilder', builder_path)):
+        seconds = min(timeit.repeat(function, number=NUMBER, repeat=3))
+        print(f"{name:>15}: {seconds / NUMBER * 1e6:8.1f} µs per message")
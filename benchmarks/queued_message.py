@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark: memory needed to keep 100,000 mails in a queue
+
+Compares EmailMessage objects and dictionaries of strings with
+bote's QueuedMessage records (plain and compressed).
+
+Run from the repository root:
+python -m benchmarks.queued_message
+~~~~~~~~~~~~~~~~~~~~~
+Source: https://github.com/RuedigerVoigt/bote
+(c) 2020-2021 Rüdiger Voigt
+Released under the Apache License 2.0
+"""
+
+from email.message import EmailMessage
+import tracemalloc
+from typing import Any, Callable, List
+
+from bote import message
+
+SENDER = 'bar@example.com'
+RECIPIENT = 'foo@example.com'
+NUMBER = 100000
+# Building 100,000 EmailMessage objects under tracemalloc takes very long.
+# Their footprint is measured on a sample:
+SAMPLE = 10000
+
+BUILDER = message.MessageBuilder(SENDER, {'default': RECIPIENT})
+
+
+def text(i: int) -> str:
+    "Alert text that differs from mail to mail."
+    return (f"Job {i} finished.\n"
+            "The crawler finished its job. No errors occured.\n" * 5)
+
+
+def as_emailmessage(i: int) -> EmailMessage:
+    msg = EmailMessage()
+    msg.set_content(text(i))
+    msg['Subject'] = 'Crawler finished'
+    msg['From'] = SENDER
+    msg['To'] = RECIPIENT
+    return msg
+
+
+def as_dict(i: int) -> dict:
+    return {'subject': 'Crawler finished',
+            'text': text(i),
+            'recipient': RECIPIENT}
+
+
+def as_queued(i: int) -> message.QueuedMessage:
+    return message.QueuedMessage.from_text(0, 'Crawler finished', text(i))
+
+
+def as_queued_compressed(i: int) -> message.QueuedMessage:
+    return message.QueuedMessage.from_text(
+        0, 'Crawler finished', text(i), compress=True)
+
+
+def measure(factory: Callable[[int], Any],
+            number: int) -> float:
+    "Return the bytes allocated per queued mail."
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    queue: List[Any] = [factory(i) for i in range(number)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del queue
+    return (after - before) / number
+
+
+if __name__ == "__main__":
+    for name, function, number in (
+            ('EmailMessage', as_emailmessage, SAMPLE),
+            ('dict of str', as_dict, NUMBER),
+            ('QueuedMessage', as_queued, NUMBER),
+            ('compressed', as_queued_compressed, NUMBER)):
+        per_message = measure(function, number)
+        print(f"{name:>14}: {per_message:8.0f} bytes per message, "
+              f"{per_message * NUMBER / 2**20:7.1f} MiB for {NUMBER:,}")
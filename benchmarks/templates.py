@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark: CPU time to prepare a recurring alert
+
+Compares formatting subject and text and calling send_mail with
+send_template, once with new variables for every mail and once with a
+small set of recurring variables (served by the render cache).
+Delivery is replaced by a no-op, so only preparing the message counts.
+
+Run from the repository root:
+python -m benchmarks.templates
+~~~~~~~~~~~~~~~~~~~~~
+Source: https://github.com/RuedigerVoigt/bote
+(c) 2020-2021 Rüdiger Voigt
+Released under the Apache License 2.0
+"""
+
+import itertools
+import timeit
+from unittest.mock import patch
+
+import bote
+
+NUMBER = 10000
+
+SUBJECT = 'Crawler job {job} failed'
+TEXT = ('The crawler stopped working on one of its jobs. This message is '
+        'sent automatically, please do not reply to it.\n'
+        '\n'
+        'Job: {job}\n'
+        'Error: {error}\n'
+        '\n'
+        'The job will be retried in one hour. If it fails again, check '
+        'the logfiles on the server and the state of the database. '
+        'Further information can be found in the documentation.\n')
+
+MAILER = bote.Mailer({'recipient': 'foo@example.com',
+                      'sender': 'bar@example.com'})
+MAILER.register_template('failure', SUBJECT, TEXT)
+
+COUNTER = itertools.count()
+
+
+def unique_variables() -> dict:
+    return {'job': next(COUNTER), 'error': 'timeout'}
+
+
+def recurring_variables() -> dict:
+    return {'job': next(COUNTER) % 20, 'error': 'timeout'}
+
+
+def format_then_send_mail(variables: dict) -> None:
+    MAILER.send_mail(SUBJECT.format(**variables), TEXT.format(**variables))
+
+
+def send_template(variables: dict) -> None:
+    MAILER.send_template('failure', **variables)
+
+
+if __name__ == "__main__":
+    with patch('bote.Mailer._Mailer__deliver'):
+        for variables_name, variables in (
+                ('unique variables', unique_variables),
+                ('recurring variables', recurring_variables)):
+            for name, function in (
+                    ('format + send_mail', format_then_send_mail),
+                    ('send_template', send_template)):
+                seconds = min(timeit.repeat(
+                    lambda f=function, v=variables: f(v()),
+                    number=NUMBER, repeat=3))
+                print(f"{variables_name:>19}, {name:>18}: "
+                      f"{seconds / NUMBER * 1e6:6.1f} µs per message")
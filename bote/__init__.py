@@ -4,8 +4,13 @@
 """A Python library to send email. Enforces encryption -
    if not sending via localhost."""
 
-from bote.__main__ import Mailer
+from bote.mailer import Mailer
 from bote import _version
+from bote import message
+from bote import pool
+from bote import template
+from bote import trace
+from bote import cli
 
 NAME = "bote"
 __version__ = f"{_version.__version__}"
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Bote: Command-line interface
+
+Send messages from a JSONL file or stdin. Each line is a JSON object with
+the keys subject, text and optionally recipient (an email address or a key
+of the recipient dictionary).
+
+Usage:
+python -m bote --config bote.ini --input messages.jsonl --workers 4
+
+Source: https://github.com/RuedigerVoigt/bote
+(c) 2020-2021 Rüdiger Voigt:
+Released under the Apache License 2.0
+"""
+
+import argparse
+import configparser
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+from typing import (Any, Dict, Iterable, List, Optional, TextIO, Tuple,
+                    Union)
+
+from bote import err
+from bote import pool
+from bote.mailer import Mailer
+
+SETTINGS = ('server', 'server_port', 'encryption', 'username', 'passphrase',
+            'recipient', 'sender', 'wrap_width')
+INTEGER_SETTINGS = ('server_port', 'wrap_width')
+
+
+def read_settings(config_file: Optional[str] = None) -> Dict[str, Any]:
+    """Read the mail settings from the section [bote] of an INI file.
+       A section [recipient] maps roles to addresses. Environment
+       variables (BOTE_SERVER, BOTE_SENDER, ...) override the file."""
+    settings: Dict[str, Any] = dict()
+    if config_file:
+        parser = configparser.ConfigParser(interpolation=None)
+        with open(config_file, 'r', encoding='utf-8') as file:
+            parser.read_file(file)
+        if parser.has_section('bote'):
+            settings.update(parser['bote'])
+        if parser.has_section('recipient'):
+            settings['recipient'] = dict(parser['recipient'])
+    for key in SETTINGS:
+        value = os.environ.get(f"BOTE_{key.upper()}", None)
+        if value:
+            settings[key] = value
+    for key in INTEGER_SETTINGS:
+        if key in settings:
+            try:
+                settings[key] = int(settings[key])
+            except ValueError as no_int:
+                raise ValueError(f"{key} must be an integer!") from no_int
+    return settings
+
+
+class BatchSender:
+    """Send messages from a JSONL stream with parallel connections.
+       Lines are handed to the workers through a bounded queue, so memory
+       use does not depend on the number of lines."""
+
+    def __init__(self,
+                 mailer: Mailer,
+                 workers: int = 4,
+                 error_stream: Optional[TextIO] = None):
+        if not isinstance(workers, int) or workers < 1:
+            raise ValueError('workers must be a positive integer!')
+        self.mailer = mailer
+        self.workers = workers
+        self.error_stream = error_stream if error_stream else sys.stderr
+        self.sent: int = 0
+        self.failed: int = 0
+        self.__lock = threading.Lock()
+        self.__jobs: queue.Queue = queue.Queue(maxsize=workers * 2)
+
+    def __send_line(self,
+                    line: Union[bytes, str]) -> None:
+        if isinstance(line, bytes):
+            # Decoded here, so an invalid byte only fails its own line:
+            line = line.decode('utf-8')
+        data = json.loads(line)
+        if not isinstance(data, dict):
+            raise ValueError('Line is not a JSON object.')
+        recipient = data.get('recipient', None)
+        if recipient:
+            recipient = self.mailer.roles.get(recipient, recipient)
+        self.mailer.send_mail(data.get('subject', ''),
+                              data.get('text', ''),
+                              recipient)
+
+    def __work(self) -> None:
+        while True:
+            job: Optional[Tuple[int, Union[bytes, str]]] = self.__jobs.get()
+            if job is None:
+                return
+            line_number, line = job
+            try:
+                self.__send_line(line)
+            except Exception as error:  # pylint: disable=broad-except
+                with self.__lock:
+                    self.failed += 1
+                    # Report at once instead of collecting the failures:
+                    print(f"line {line_number}: "
+                          f"{type(error).__name__}: {error}",
+                          file=self.error_stream)
+            else:
+                with self.__lock:
+                    self.sent += 1
+
+    def run(self,
+            lines: Iterable[Union[bytes, str]]) -> int:
+        """Send a message for every non-empty line. Return the failed count.
+           Lines can be bytes (decoded as UTF-8) or str."""
+        threads: List[threading.Thread] = list()
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self.__work, daemon=True)
+            thread.start()
+            threads.append(thread)
+        try:
+            for line_number, line in enumerate(lines, start=1):
+                if line.strip():
+                    self.__jobs.put((line_number, line))
+        finally:
+            # Stop the workers even if reading the input failed:
+            for _ in threads:
+                self.__jobs.put(None)
+            for thread in threads:
+                thread.join()
+        return self.failed
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    "Entry point for python -m bote. Return the exit status."
+    parser = argparse.ArgumentParser(
+        prog='bote',
+        description='Send messages from a JSONL file or stdin.')
+    parser.add_argument('-c', '--config',
+                        help='INI file with a [bote] section')
+    parser.add_argument('-i', '--input', default='-',
+                        help='JSONL file with messages (default: stdin)')
+    parser.add_argument('-w', '--workers', type=int, default=4,
+                        help='number of parallel connections (default: 4)')
+    # Failed lines are reported anyway. At the default level the
+    # tracebacks bote logs for each of them are not shown:
+    parser.add_argument('--log-level', default='CRITICAL',
+                        choices=('DEBUG', 'INFO', 'WARNING', 'ERROR',
+                                 'CRITICAL'),
+                        help='show log messages of bote with this level '
+                             '(default: CRITICAL)')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=args.log_level)
+
+    try:
+        mailer = Mailer(read_settings(args.config))
+        sender = BatchSender(mailer, args.workers)
+        # One pooled connection per worker:
+        pool.configure_pool(max_size=args.workers)
+    except (OSError, ValueError, configparser.Error,
+            err.BoteException) as error:
+        print(f"bote: {error}", file=sys.stderr)
+        return 2
+
+    # The input is read in binary mode. Each line is decoded as UTF-8 by
+    # the worker, so one invalid byte does not stop the whole batch.
+    if args.input == '-':
+        failed = sender.run(sys.stdin.buffer)
+    else:
+        try:
+            with open(args.input, 'rb') as file:
+                failed = sender.run(file)
+        except OSError as error:
+            print(f"bote: {error}", file=sys.stderr)
+            return 2
+    print(f"bote: {sender.sent} sent, {failed} failed", file=sys.stderr)
+    return 1 if failed else 0
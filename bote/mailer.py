@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Send email """
+
+from email.message import EmailMessage
+import logging
+import smtplib
+import ssl
+import textwrap
+from typing import Any, Dict, Optional, Union
+
+# sister-projects:
+import compatibility
+import userprovided
+
+from bote import err
+from bote import _version as version
+from bote import message
+from bote import pool
+from bote import template
+from bote import trace
+
+
+class Mailer:
+    "Class of bote to send email"
+    # pylint: disable=too-few-public-methods
+    # pylint: disable=too-many-branches
+    # pylint: disable=too-many-instance-attributes
+    # pylint: disable=unidiomatic-typecheck
+
+    def __init__(self,
+                 mail_settings: Dict[str, Any]):
+        """Check the mail settings for plausibility and set
+           missing values to their default. """
+
+        compatibility.Check(
+            package_name='bote',
+            package_version=version.__version__,
+            release_date=version.release_date,
+            python_version_support={
+                'min_version': '3.6',
+                'incompatible_versions': [],
+                'max_tested_version': '3.10'},
+            nag_over_update={
+                    'nag_days_after_release': 365,
+                    'nag_in_hundred': 100},
+            language_messages='en',
+            system_support={
+                'full': {'Linux', 'Windows', 'MacOS'}
+            }
+        )
+
+        userprovided.parameters.validate_dict_keys(
+            dict_to_check=mail_settings,
+            allowed_keys={'server', 'server_port', 'encryption',
+                          'username', 'passphrase',
+                          'recipient', 'sender',
+                          'wrap_width', 'trace'},
+            necessary_keys={'recipient', 'sender'},
+            dict_name='mail_settings')
+
+        # Not all keys must be there.
+        # Provide default values for missing ones with defaultdict:
+
+        self.server: str = mail_settings.get('server', 'localhost')
+        self.is_local = bool(self.server in ('localhost', '127.0.0.1', '::1'))
+
+        # Encryption defaults to 'off' as the default for server is localhost.
+        self.encryption: str = mail_settings.get('encryption', 'off')
+
+        if self.encryption not in ('off', 'starttls', 'ssl'):
+            raise ValueError('Invalid value for the encryption parameter!')
+        # Enforce encryption if the connection is not to localhost:
+        if not self.is_local and self.encryption == 'off':
+            raise err.UnencryptedRemoteConnection(
+                'Connection is not local, but unencrypted!')
+
+        self.server_port = mail_settings.get('server_port', None)
+        if self.server_port:
+            if not userprovided.parameters.is_port(self.server_port):
+                raise ValueError('Port must be integer (0 to 65535)')
+        elif not self.is_local:
+            raise ValueError(
+                'Provide a port if you connect to a remote SMTP server.')
+
+        self.username = mail_settings.get('username', None)
+        self.passphrase = mail_settings.get('passphrase', None)
+        # Even for a remote connection username and passphrase might be
+        # not necessary - for example if the identification is host based.
+        # Therfore no exception is thrown.
+        if not self.username:
+            logging.debug('Parameter username is empty.')
+        if not self.passphrase:
+            logging.debug('Parameter passphrase is empty.')
+
+        self.default_recipient: str = ''
+        self.recipient: Union[str, dict] = mail_settings['recipient']
+
+        if type(self.recipient) == dict:
+            if len(self.recipient) == 0:
+                raise ValueError('Dictionary recipient is empty.')
+
+            # Warn if there is no default key
+            try:
+                self.default_recipient = self.recipient['default']
+            except KeyError:
+                logging.warning("No default key in recipient dictionary!")
+
+            # TO DO: check for all recipient keys if mailadresses are valid
+
+        elif type(self.recipient) == str:
+            if not userprovided.mail.is_email(str(self.recipient)):
+                raise err.NotAnEmail('recipient is not a valid email!')
+            self.default_recipient = self.recipient
+        else:
+            raise ValueError(
+                'Parameter recipient must be either string or dictionary.')
+
+        self.sender = mail_settings['sender']
+        if not userprovided.mail.is_email(self.sender):
+            raise err.NotAnEmail('sender is not a valid email!')
+
+        self.wrap_width = mail_settings.get('wrap_width', 80)
+        if not isinstance(self.wrap_width, int):
+            raise ValueError('wrap_width is not an integer!')
+
+        # The header block for each recipient role is encoded only once:
+        self.roles: Dict[str, str] = dict()
+        if type(self.recipient) == dict:
+            self.roles = dict(self.recipient)
+        else:
+            self.roles = {'default': str(self.recipient)}
+        self.message_builder = message.MessageBuilder(self.sender, self.roles)
+
+        # Create SSL context. According to the docs this will:
+        # * load the system’s trusted CA certificates,
+        # * enable certificate validation and hostname checking,
+        # * try to choose reasonably secure protocol and cipher settings.
+        # see:
+        # https://docs.python.org/3/library/ssl.html#ssl-security
+        self.context = ssl.create_default_context()
+
+        # Named templates for send_template:
+        self.templates = template.TemplateRegistry(self.wrap_width)
+
+        # Trace mode records timing spans for each stage of send_mail:
+        trace_enabled = mail_settings.get('trace', None)
+        if trace_enabled is None:
+            trace_enabled = trace.enabled_by_environment()
+        if not isinstance(trace_enabled, bool):
+            raise ValueError('trace must be True or False!')
+        self.tracer: Optional[trace.Tracer] = (
+            trace.Tracer() if trace_enabled else None)
+
+        # Mailer instances with the same settings share connections:
+        self.pool_key: pool.PoolKey = (
+            self.server, self.server_port, self.encryption, self.username,
+            pool.credential_fingerprint(self.username, self.passphrase))
+
+    def __connect_unencrypted(self) -> smtplib.SMTP:
+        return smtplib.SMTP(self.server)
+
+    def __connect_ssl(self) -> smtplib.SMTP:
+        s = smtplib.SMTP_SSL(host=self.server,
+                             port=self.server_port,
+                             context=self.context)
+        try:
+            s.login(self.username, self.passphrase)
+        except BaseException:
+            s.close()
+            raise
+        return s
+
+    def __connect_starttls(self) -> smtplib.SMTP:
+        s = smtplib.SMTP(self.server,
+                         self.server_port)
+        try:
+            s.starttls(context=self.context)
+            s.login(self.username, self.passphrase)
+        except BaseException:
+            s.close()
+            raise
+        return s
+
+    def __send_unencrypted(self,
+                           recipient: str,
+                           msg: bytes) -> None:
+        pool.default_pool.send(self.pool_key, self.__connect_unencrypted,
+                               self.sender, [recipient], msg)
+
+    def __send_ssl(self,
+                   recipient: str,
+                   msg: bytes) -> None:
+        pool.default_pool.send(self.pool_key, self.__connect_ssl,
+                               self.sender, [recipient], msg)
+
+    def __send_starttls(self,
+                        recipient: str,
+                        msg: bytes) -> None:
+        pool.default_pool.send(self.pool_key, self.__connect_starttls,
+                               self.sender, [recipient], msg)
+
+    def __check_content(self,
+                        message_subject: str,
+                        message_text: str) -> None:
+        "Check that subject and text are not empty."
+        if message_subject == '' or message_subject is None:
+            raise err.MissingSubject(
+                'Mails without subject will likely be classified as spam.')
+
+        if message_text == '' or message_text is None:
+            raise err.MissingMailContent('No mail content supplied.')
+
+    def __wrap(self,
+               message_text: str) -> str:
+        "Wrap the text after wrap_width characters."
+        wrap = textwrap.TextWrapper(width=self.wrap_width)
+
+        # To preserve intentional linebreaks, the text is wrapped linewise.
+        wrapped_text = ''
+        for line in str.splitlines(message_text):
+            wrapped_text += wrap.fill(line) + "\n"
+        return wrapped_text
+
+    def __build(self,
+                recipient: str,
+                message_subject: str,
+                body: bytes) -> bytes:
+        "Build the message. Log errors like sending errors."
+        try:
+            return self.message_builder.build_from_body(
+                recipient, message_subject, body)
+        except Exception:
+            # For example a line break in the subject:
+            logging.exception('Problem sending mail!', exc_info=True)
+            raise
+
+    def __deliver(self,
+                  recipient: str,
+                  msg: bytes) -> None:
+        try:
+            if self.encryption == 'off':
+                self.__send_unencrypted(recipient, msg)
+            elif self.encryption == 'ssl':
+                self.__send_ssl(recipient, msg)
+            else:
+                self.__send_starttls(recipient, msg)
+        except smtplib.SMTPAuthenticationError:
+            logging.exception(
+                'SMTP authentication failed: check username / passphrase.')
+            raise
+        except smtplib.SMTPSenderRefused:
+            logging.exception('SMTP server refused sender.')
+            raise
+        except smtplib.SMTPRecipientsRefused:
+            logging.exception('SMTP server refused recipient.')
+            raise
+        except smtplib.SMTPServerDisconnected:
+            logging.exception('SMTP server unexpectedly disconnected.')
+            raise
+        except (smtplib.SMTPException, Exception):
+            logging.exception('Problem sending mail!', exc_info=True)
+            raise
+
+    def send_mail(self,
+                  message_subject: str,
+                  message_text: str,
+                  overwrite_recipient: Optional[str] = None) -> None:
+        """Send an email.
+           Sender and receiver were fixed with the constructor.
+           With overwrite_receiver you change the recipient for this mail."""
+
+        if self.tracer is not None:
+            self.__send_mail_traced(
+                message_subject, message_text, overwrite_recipient)
+            return
+
+        recipient: str = overwrite_recipient if overwrite_recipient else self.default_recipient
+        if not userprovided.mail.is_email(recipient):
+            raise ValueError('Recipient is not valid')
+
+        self.__check_content(message_subject, message_text)
+        wrapped_text = self.__wrap(message_text)
+        msg = self.__build(
+            recipient, message_subject, message.encode_body(wrapped_text))
+        self.__deliver(recipient, msg)
+
+    def __send_mail_traced(self,
+                           message_subject: str,
+                           message_text: str,
+                           overwrite_recipient: Optional[str] = None) -> None:
+        """Same steps as send_mail, but record a span for each of them.
+           Kept apart so send_mail has no overhead if tracing is off."""
+        assert self.tracer is not None
+        tracer = self.tracer
+        start = first_start = tracer.clock()
+        try:
+            recipient: str = overwrite_recipient if overwrite_recipient else self.default_recipient
+            if not userprovided.mail.is_email(recipient):
+                raise ValueError('Recipient is not valid')
+            self.__check_content(message_subject, message_text)
+            start = tracer.span('validate', start)
+
+            wrapped_text = self.__wrap(message_text)
+            start = tracer.span('wrap', start, len(wrapped_text))
+
+            msg = self.__build(recipient, message_subject,
+                               message.encode_body(wrapped_text))
+            start = tracer.span('build', start, len(msg))
+
+            try:
+                self.__deliver(recipient, msg)
+            finally:
+                tracer.span('smtp', start)
+        finally:
+            tracer.span('send_mail', first_start)
+
+    def queue_message(self,
+                      message_subject: str,
+                      message_text: str,
+                      role: str = 'default',
+                      compress: bool = False) -> message.QueuedMessage:
+        """Check, wrap and encode a message for a key of the recipient
+           dictionary, but do not send it yet. Returns a compact record
+           to keep in a queue. Send it later with send_queued_message."""
+        if role not in self.roles:
+            raise ValueError(f"Unknown recipient role '{role}'!")
+        if not userprovided.mail.is_email(self.roles[role]):
+            raise ValueError('Recipient is not valid')
+        self.__check_content(message_subject, message_text)
+        wrapped_text = self.__wrap(message_text)
+        return message.QueuedMessage.from_text(
+            self.message_builder.role_names.index(role),
+            message_subject, wrapped_text, compress)
+
+    def send_queued_message(self,
+                            queued_message: message.QueuedMessage) -> None:
+        """Send a message created with queue_message. The record only
+           stores the position of its role in the recipient dictionary.
+           So it must be sent by the Mailer that created it or by one with
+           the same recipient dictionary. A ValueError is raised if the
+           position does not exist in this Mailer."""
+        self.__deliver(queued_message.recipient(self.message_builder),
+                       queued_message.to_bytes(self.message_builder))
+
+    def to_email_message(self,
+                         queued_message: message.QueuedMessage
+                         ) -> EmailMessage:
+        """Convert a message created with queue_message into an
+           EmailMessage. Use the Mailer that created it."""
+        return queued_message.to_email_message(self.message_builder)
+
+    def register_template(self,
+                          template_name: str,
+                          message_subject: str,
+                          message_text: str) -> None:
+        """Define a named template for send_template. Subject and text use
+           the syntax of str.format with named fields. Lines without fields
+           are wrapped at once."""
+        self.templates.register(template_name, message_subject, message_text)
+
+    def send_template(self,
+                      template_name: str,
+                      overwrite_recipient: Optional[str] = None,
+                      **variables: Any) -> None:
+        """Fill a template registered with register_template and send it.
+           The result is the same as formatting subject and text yourself
+           and calling send_mail, but faster. Pass template_name and
+           overwrite_recipient by position: register_template rejects
+           fields with these names, so they never clash with variables."""
+        recipient: str = overwrite_recipient if overwrite_recipient else self.default_recipient
+        if not userprovided.mail.is_email(recipient):
+            raise ValueError('Recipient is not valid')
+
+        message_subject, body = self.templates.render_encoded(
+            template_name, variables)
+        msg = self.__build(recipient, message_subject, body)
+        self.__deliver(recipient, msg)
+
+    def send_mail_to_admin(self,
+                           message_subject: str,
+                           message_text: str) -> None:
+        """If a dictionary is used for recipient and if it contains an
+           admin key: send an email to the corresponding address."""
+        if type(self.recipient) != dict or 'admin' not in self.recipient:
+            raise ValueError('Mail address for admin not set with init!')
+        self.send_mail(
+            message_subject,
+            message_text,
+            self.recipient['admin']
+            )
+
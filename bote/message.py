@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Bote: Build plain-text messages as bytes
+
+Building an email.message.EmailMessage and serializing it with
+smtplib's send_message runs every header through the policy machinery.
+For the plain-text mails bote sends this is far more work than needed.
+The MessageBuilder encodes the static headers (From, To, MIME headers)
+once and only adds Subject, Date and Message-ID for each mail.
+
+Source: https://github.com/RuedigerVoigt/bote
+(c) 2020-2021 Rüdiger Voigt:
+Released under the Apache License 2.0
+"""
+
+import binascii
+import email
+from email.message import EmailMessage
+import email.policy
+import email.utils
+import sys
+from typing import Dict, Optional
+import zlib
+
+# sister-project:
+import userprovided
+
+# Headers are folded if they are longer than this (see RFC 5322 and
+# email.policy.EmailPolicy.max_line_length):
+MAX_LINE_LENGTH = 78
+
+STATIC_MIME_HEADERS = (b'MIME-Version: 1.0\r\n'
+                       b'Content-Type: text/plain; charset="utf-8"\r\n')
+
+
+def _check_header_value(value: str) -> None:
+    "Prevent header injection. Same check as in email.policy."
+    if '\n' in value or '\r' in value:
+        raise ValueError('Header values may not contain linefeed '
+                         'or carriage return characters')
+
+
+def encode_header(name: str,
+                  value: str) -> bytes:
+    """Return a single header line as bytes including the line ending.
+       Short ASCII values are written as they are. Everything else is
+       folded and encoded by the SMTP policy of the email package."""
+    _check_header_value(value)
+    if len(name) + len(value) + 2 <= MAX_LINE_LENGTH:
+        try:
+            return f"{name}: {value}\r\n".encode('ascii')
+        except UnicodeEncodeError:
+            pass
+    return email.policy.SMTP.fold_binary(name, value)
+
+
+def encode_body(text: str) -> bytes:
+    """Return the Content-Transfer-Encoding header and the body of the
+       message. Like EmailMessage.set_content this uses 7bit if possible
+       and quoted-printable otherwise."""
+    data = text.encode('utf-8')
+    lines = data.splitlines()
+    if max((len(line) for line in lines), default=0) <= MAX_LINE_LENGTH:
+        try:
+            data.decode('ascii')
+            return (b'Content-Transfer-Encoding: 7bit\r\n\r\n' +
+                    b'\r\n'.join(lines) + b'\r\n')
+        except UnicodeDecodeError:
+            pass
+    encoded = binascii.b2a_qp(b'\n'.join(lines) + b'\n', istext=True)
+    return (b'Content-Transfer-Encoding: quoted-printable\r\n\r\n' +
+            encoded.replace(b'\n', b'\r\n'))
+
+
+class MessageBuilder:
+    """Build RFC compliant plain-text messages ready for smtplib's
+       sendmail(). The header block with sender and recipient is
+       pre-encoded for every recipient role at construction."""
+
+    def __init__(self,
+                 sender: str,
+                 roles: Dict[str, str]):
+        self.sender = sender
+        self.roles = roles
+        # QueuedMessage refers to a role by its position in this tuple:
+        self.role_names = tuple(roles)
+        self.domain = sender.rpartition('@')[2]
+        self.from_header = encode_header('From', sender)
+        # Keyed by the recipient's address, so a mail to an address that
+        # happens to belong to a role also uses the cached block:
+        # The constructor of Mailer does not validate the values of the
+        # recipient dictionary. Invalid ones are skipped here, so they fail
+        # when a mail is sent to them - not when the Mailer is created.
+        self.header_blocks: Dict[str, bytes] = dict()
+        for address in roles.values():
+            if (isinstance(address, str) and
+                    '\n' not in address and '\r' not in address and
+                    userprovided.mail.is_email(address)):
+                self.header_blocks[address] = self.__header_block(address)
+
+    def __header_block(self,
+                       recipient: str) -> bytes:
+        return (self.from_header +
+                encode_header('To', recipient) +
+                STATIC_MIME_HEADERS)
+
+    def build(self,
+              recipient: str,
+              message_subject: str,
+              message_text: str,
+              date: Optional[str] = None,
+              message_id: Optional[str] = None) -> bytes:
+        """Return the complete message as bytes with CRLF line endings.
+           Date and Message-ID are generated if not provided."""
+        return self.build_from_body(recipient, message_subject,
+                                    encode_body(message_text),
+                                    date, message_id)
+
+    def build_from_body(self,
+                        recipient: str,
+                        message_subject: str,
+                        body: bytes,
+                        date: Optional[str] = None,
+                        message_id: Optional[str] = None) -> bytes:
+        """Like build, but with a body that was already encoded
+           by encode_body."""
+        header_block = self.header_blocks.get(recipient, None)
+        if header_block is None:
+            # Addresses outside the routing table are not cached as
+            # that would let the cache grow without bound.
+            header_block = self.__header_block(recipient)
+        if date is None:
+            date = email.utils.formatdate(localtime=True)
+        if message_id is None:
+            message_id = email.utils.make_msgid(domain=self.domain)
+        return (header_block +
+                encode_header('Subject', message_subject) +
+                encode_header('Date', date) +
+                encode_header('Message-ID', message_id) +
+                body)
+
+
+class QueuedMessage:
+    """Compact record of a message waiting to be sent.
+       The recipient is stored as an index into the role names of the
+       Mailer, the subject is interned and the body is kept as encoded,
+       optionally zlib compressed, bytes. Use Mailer.queue_message to
+       create one."""
+    __slots__ = ('role', 'subject', 'body', 'compressed')
+
+    def __init__(self,
+                 role: int,
+                 subject: str,
+                 body: bytes,
+                 compressed: bool = False):
+        self.role = role
+        # Recurring subjects share a single string object:
+        self.subject = sys.intern(subject)
+        self.body = body
+        self.compressed = compressed
+
+    @classmethod
+    def from_text(cls,
+                  role: int,
+                  subject: str,
+                  text: str,
+                  compress: bool = False) -> 'QueuedMessage':
+        "Encode the text and compress it if that saves space."
+        _check_header_value(subject)
+        body = encode_body(text)
+        if compress:
+            compressed_body = zlib.compress(body)
+            if len(compressed_body) < len(body):
+                return cls(role, subject, compressed_body, True)
+        return cls(role, subject, body, False)
+
+    def encoded_body(self) -> bytes:
+        "Return the body as produced by encode_body."
+        return zlib.decompress(self.body) if self.compressed else self.body
+
+    def recipient(self,
+                  builder: MessageBuilder) -> str:
+        """Look up the recipient's address in the routing table. Raises a
+           ValueError if the role index does not exist in it."""
+        if not 0 <= self.role < len(builder.role_names):
+            raise ValueError(
+                f"Role index {self.role} is not in the routing table! "
+                "Send the message with the Mailer that created it.")
+        return builder.roles[builder.role_names[self.role]]
+
+    def to_bytes(self,
+                 builder: MessageBuilder) -> bytes:
+        "Return the complete message ready for smtplib's sendmail()."
+        return builder.build_from_body(
+            self.recipient(builder), self.subject, self.encoded_body())
+
+    def to_email_message(self,
+                         builder: MessageBuilder) -> EmailMessage:
+        "Convert the record into an EmailMessage. Only do so if needed."
+        msg_bytes = self.to_bytes(builder)
+        msg = email.message_from_bytes(msg_bytes.replace(b'\r\n', b'\n'),
+                                       policy=email.policy.default)
+        assert isinstance(msg, EmailMessage)
+        return msg
+
+    def __repr__(self) -> str:
+        return (f"QueuedMessage(role={self.role!r}, "
+                f"subject={self.subject!r}, "
+                f"{len(self.body)} bytes, compressed={self.compressed!r})")
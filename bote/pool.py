@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Bote: Process-wide pool of SMTP connections
+
+All Mailer instances with the same server, port, encryption and
+credentials share the connections in default_pool. A connection is closed after
+max_messages mails or after it has been idle for idle_timeout seconds.
+A timer closes idle connections even if nothing is sent anymore.
+Child processes never reuse a connection of their parent.
+
+Source: https://github.com/RuedigerVoigt/bote
+(c) 2020-2021 Rüdiger Voigt:
+Released under the Apache License 2.0
+"""
+
+import atexit
+import hashlib
+import hmac
+import logging
+import os
+import smtplib
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+# (server, server_port, encryption, username, credential fingerprint)
+PoolKey = Tuple[str, Optional[int], str, Optional[str], Optional[str]]
+
+# Random per process, so the fingerprints do not reveal the passphrase:
+_FINGERPRINT_KEY = os.urandom(32)
+
+
+def credential_fingerprint(username: Optional[str],
+                           passphrase: Optional[str]) -> Optional[str]:
+    """Return a keyed hash of the credentials. Mailer instances only share
+       connections if their credentials are identical, as login() only
+       runs when a new connection is opened."""
+    if not username and not passphrase:
+        return None
+    credentials = f"{username or ''}\0{passphrase or ''}".encode('utf-8')
+    return hmac.new(_FINGERPRINT_KEY, credentials, hashlib.sha256).hexdigest()
+
+
+class PooledConnection:
+    "An open SMTP connection and how it was used so far."
+    __slots__ = ('smtp', 'messages', 'last_used')
+
+    def __init__(self,
+                 smtp: smtplib.SMTP):
+        self.smtp = smtp
+        self.messages: int = 0
+        self.last_used: float = time.monotonic()
+
+
+def _close(smtp: smtplib.SMTP) -> None:
+    "Say goodbye to the server, but do not fail if it is already gone."
+    try:
+        smtp.quit()
+    except (smtplib.SMTPException, OSError):
+        smtp.close()
+
+
+class ConnectionPool:
+    """Thread-safe pool of SMTP connections.
+       max_size limits the number of open connections per key. If all of
+       them are in use, callers wait until one is released."""
+
+    def __init__(self,
+                 max_size: int = 4,
+                 max_messages: int = 100,
+                 idle_timeout: float = 30.0):
+        self.max_size: int = 4
+        self.max_messages: int = 100
+        self.idle_timeout: float = 30.0
+        self.__reset()
+        self.configure(max_size, max_messages, idle_timeout)
+
+    def __reset(self) -> None:
+        self.__pid = os.getpid()
+        self.__lock = threading.Lock()
+        self.__available = threading.Condition(self.__lock)
+        # Idle connections ordered from least to most recently used:
+        self.__idle: Dict[PoolKey, List[PooledConnection]] = dict()
+        # Number of open connections (idle and in use) per key:
+        self.__open: Dict[PoolKey, int] = dict()
+        # Closes idle connections once they expire. Timer threads do not
+        # survive a fork, so the child starts without one:
+        self.__reaper: Optional[threading.Timer] = None
+
+    def __check_fork(self) -> None:
+        if os.getpid() != self.__pid:
+            # A forked child shares the sockets of its parent. Forget them
+            # without sending QUIT as that would end the parent's session.
+            # The child only runs one thread, so no lock is needed here.
+            logging.debug('Fork detected: discarding inherited connections.')
+            self.__reset()
+
+    def configure(self,
+                  max_size: Optional[int] = None,
+                  max_messages: Optional[int] = None,
+                  idle_timeout: Optional[float] = None) -> None:
+        "Change the limits of the pool. Parameters set to None stay as is."
+        if max_size is not None:
+            if not isinstance(max_size, int) or max_size < 1:
+                raise ValueError('max_size must be a positive integer!')
+        if max_messages is not None:
+            if not isinstance(max_messages, int) or max_messages < 1:
+                raise ValueError('max_messages must be a positive integer!')
+        if idle_timeout is not None:
+            if not isinstance(idle_timeout, (int, float)) or idle_timeout < 0:
+                raise ValueError('idle_timeout must be a positive number!')
+        self.__check_fork()
+        with self.__available:
+            if max_size is not None:
+                self.max_size = max_size
+            if max_messages is not None:
+                self.max_messages = max_messages
+            if idle_timeout is not None:
+                self.idle_timeout = float(idle_timeout)
+                # Reschedule for the new timeout:
+                self.__cancel_reaper()
+                self.__arm_reaper()
+            self.__available.notify_all()
+
+    def __evict_idle(self) -> List[PooledConnection]:
+        "Remove expired connections. Call with the lock held."
+        expired: List[PooledConnection] = list()
+        deadline = time.monotonic() - self.idle_timeout
+        for key, idle in self.__idle.items():
+            while idle and idle[0].last_used < deadline:
+                expired.append(idle.pop(0))
+                self.__open[key] -= 1
+        if expired:
+            self.__available.notify_all()
+        return expired
+
+    def __arm_reaper(self) -> None:
+        """Start a timer that fires when the least recently used idle
+           connection expires. Call with the lock held."""
+        if self.__reaper is not None:
+            return
+        oldest = [idle[0].last_used for idle in self.__idle.values() if idle]
+        if not oldest:
+            return
+        delay = max(min(oldest) + self.idle_timeout - time.monotonic(), 0.0)
+        self.__reaper = threading.Timer(delay, self.__reap)
+        self.__reaper.daemon = True
+        self.__reaper.start()
+
+    def __cancel_reaper(self) -> None:
+        "Call with the lock held."
+        if self.__reaper is not None:
+            self.__reaper.cancel()
+            self.__reaper = None
+
+    def __reap(self) -> None:
+        "Close expired idle connections even if nothing is sent anymore."
+        if os.getpid() != self.__pid:
+            return
+        with self.__available:
+            self.__reaper = None
+            expired = self.__evict_idle()
+            self.__arm_reaper()
+        # Network I/O happens outside the lock:
+        for stale in expired:
+            _close(stale.smtp)
+
+    def acquire(self,
+                key: PoolKey,
+                connect: Callable[[], smtplib.SMTP]
+                ) -> Tuple[PooledConnection, bool]:
+        """Return a connection for key and whether it was reused.
+           Opens a new connection with connect() if none is idle."""
+        self.__check_fork()
+        with self.__available:
+            while True:
+                expired = self.__evict_idle()
+                idle = self.__idle.get(key, None)
+                if idle:
+                    connection: Optional[PooledConnection] = idle.pop()
+                    break
+                if self.__open.get(key, 0) < self.max_size:
+                    self.__open[key] = self.__open.get(key, 0) + 1
+                    connection = None
+                    break
+                self.__available.wait()
+        # Network I/O happens outside the lock:
+        for stale in expired:
+            _close(stale.smtp)
+        if connection is not None:
+            return connection, True
+        try:
+            return PooledConnection(connect()), False
+        except BaseException:
+            with self.__available:
+                self.__open[key] -= 1
+                self.__available.notify()
+            raise
+
+    def release(self,
+                key: PoolKey,
+                connection: PooledConnection,
+                reusable: bool = True) -> None:
+        """Return a connection to the pool. It is closed if it is not
+           reusable or has reached the message limit."""
+        if os.getpid() != self.__pid:
+            # Acquired before a fork: the parent still owns it.
+            return
+        close = not reusable or connection.messages >= self.max_messages
+        with self.__available:
+            if close:
+                self.__open[key] -= 1
+            else:
+                connection.last_used = time.monotonic()
+                self.__idle.setdefault(key, list()).append(connection)
+                self.__arm_reaper()
+            self.__available.notify()
+        if close:
+            _close(connection.smtp)
+
+    def send(self,
+             key: PoolKey,
+             connect: Callable[[], smtplib.SMTP],
+             from_addr: str,
+             to_addrs: List[str],
+             msg: bytes) -> None:
+        """Send a message with a pooled connection. If a reused connection
+           was closed by the server in the meantime, retry with another."""
+        while True:
+            connection, reused = self.acquire(key, connect)
+            try:
+                connection.smtp.sendmail(from_addr, to_addrs, msg)
+            except (smtplib.SMTPServerDisconnected, ConnectionError):
+                self.release(key, connection, reusable=False)
+                if reused:
+                    logging.debug('Pooled connection went stale. Retrying.')
+                    continue
+                raise
+            except smtplib.SMTPResponseException as response:
+                self.release(key, connection, reusable=False)
+                # Servers usually end an idle session with 421. sendmail
+                # then reads that reply for MAIL FROM and raises
+                # SMTPSenderRefused(421, ...):
+                if reused and response.smtp_code == 421:
+                    logging.debug('Pooled connection timed out. Retrying.')
+                    continue
+                raise
+            except BaseException:
+                # The state of the SMTP session is unknown:
+                self.release(key, connection, reusable=False)
+                raise
+            connection.messages += 1
+            self.release(key, connection)
+            return
+
+    def close_all(self) -> None:
+        "Close all idle connections. Connections in use are not affected."
+        self.__check_fork()
+        to_close: List[PooledConnection] = list()
+        with self.__available:
+            for key, idle in self.__idle.items():
+                self.__open[key] -= len(idle)
+                to_close.extend(idle)
+                idle.clear()
+            self.__cancel_reaper()
+            self.__available.notify_all()
+        for connection in to_close:
+            _close(connection.smtp)
+
+
+# Shared by all Mailer instances of this process:
+default_pool = ConnectionPool()
+atexit.register(default_pool.close_all)
+
+
+def configure_pool(max_size: Optional[int] = None,
+                   max_messages: Optional[int] = None,
+                   idle_timeout: Optional[float] = None) -> None:
+    "Change the limits of the pool shared by all Mailer instances."
+    default_pool.configure(max_size, max_messages, idle_timeout)
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Bote: Message templates
+
+Templates use the syntax of str.format with named fields, for example
+'Job {job} failed after {seconds} seconds.'. Lines of the body without
+fields are wrapped once at registration. Only lines with fields are
+wrapped again for each message. Rendered and encoded messages are kept
+in a LRU cache, so repeated alerts with the same variables are not
+rendered again.
+
+Source: https://github.com/RuedigerVoigt/bote
+(c) 2020-2021 Rüdiger Voigt:
+Released under the Apache License 2.0
+"""
+
+from collections import OrderedDict
+import string
+import textwrap
+import threading
+from typing import Any, Dict, List, Set, Tuple
+
+from bote import err
+from bote import message
+
+DEFAULT_CACHE_SIZE = 256
+
+_FORMATTER = string.Formatter()
+
+
+# Parameters of Mailer.send_template. Variables with these names would
+# clash with them:
+RESERVED_NAMES = frozenset({'template_name', 'overwrite_recipient'})
+
+
+# Values of these exact types are equal only if they format the same:
+SIMPLE_TYPES = frozenset({str, int, bool, type(None)})
+
+
+def _replacement_fields(line: str) -> List[str]:
+    "Return every replacement field of the line as a format string."
+    fields: List[str] = list()
+    for _, field_name, format_spec, conversion in _FORMATTER.parse(line):
+        if field_name is None:
+            continue
+        field = '{' + field_name
+        if conversion:
+            field += '!' + conversion
+        if format_spec:
+            field += ':' + format_spec
+        fields.append(field + '}')
+    return fields
+
+
+def _field_names(line: str) -> Set[str]:
+    """Return the names of the replacement fields in the line. Raises a
+       ValueError for positional fields as templates are filled by
+       keyword and for reserved names."""
+    names: Set[str] = set()
+    for _, field_name, _, _ in _FORMATTER.parse(line):
+        if field_name is None:
+            continue
+        first_part = field_name.split('.')[0].split('[')[0]
+        if first_part == '' or first_part.isdigit():
+            raise ValueError('Templates only support named fields!')
+        if first_part in RESERVED_NAMES:
+            raise ValueError(
+                f"'{first_part}' cannot be used as a template field!")
+        names.add(first_part)
+    return names
+
+
+class MessageTemplate:
+    """A subject and body template. The body is split into lines and
+       static lines are wrapped at construction."""
+
+    def __init__(self,
+                 subject: str,
+                 text: str,
+                 wrap_width: int):
+        if subject == '' or subject is None:
+            raise err.MissingSubject(
+                'Mails without subject will likely be classified as spam.')
+        if text == '' or text is None:
+            raise err.MissingMailContent('No mail content supplied.')
+        _field_names(subject)
+        self.subject = subject
+        # Every distinct replacement field of subject and text:
+        self.fields: List[str] = list(dict.fromkeys(
+            _replacement_fields(subject) + _replacement_fields(text)))
+        self.wrapper = textwrap.TextWrapper(width=wrap_width)
+        # (False, wrapped text) for static lines,
+        # (True, format string) for lines with fields. Those keep their
+        # line ending: a variable that is empty or ends with a line break
+        # must not remove a line.
+        self.lines: List[Tuple[bool, str]] = list()
+        for line in text.splitlines(keepends=True):
+            if _field_names(line):
+                self.lines.append((True, line))
+            else:
+                # Formatting turns '{{' into '{':
+                static_line = ''.join(str.splitlines(line.format()))
+                self.lines.append((False,
+                                   self.wrapper.fill(static_line) + "\n"))
+
+    def cache_key(self,
+                  variables: Dict[str, Any]) -> Any:
+        """Return a key for the render cache. Values that compare equal
+           can still format differently, for example Decimal('1.00') and
+           Decimal('1.0') or datetimes in different time zones. So the key
+           only contains the values if all of them have simple types.
+           Otherwise it contains what the fields format to."""
+        if all(type(value) in SIMPLE_TYPES for value in variables.values()):
+            # With the type 1 and True are different keys:
+            return frozenset((var, type(value), value)
+                             for var, value in variables.items())
+        return tuple(field.format(**variables) for field in self.fields)
+
+    def render(self,
+               variables: Dict[str, Any]) -> Tuple[str, str]:
+        """Return subject and wrapped text. The result is the same as
+           formatting subject and text and passing them to send_mail."""
+        parts: List[str] = list()
+        for has_fields, line_template in self.lines:
+            if not has_fields:
+                parts.append(line_template)
+                continue
+            # A variable might contain line breaks:
+            for line in str.splitlines(line_template.format(**variables)):
+                parts.append(self.wrapper.fill(line) + "\n")
+        return self.subject.format(**variables), ''.join(parts)
+
+
+class TemplateRegistry:
+    "Named templates of a Mailer and a LRU cache of rendered messages."
+
+    def __init__(self,
+                 wrap_width: int,
+                 cache_size: int = DEFAULT_CACHE_SIZE):
+        if not isinstance(cache_size, int) or cache_size < 0:
+            raise ValueError('cache_size must be a positive integer or 0!')
+        self.wrap_width = wrap_width
+        self.cache_size = cache_size
+        self.templates: Dict[str, MessageTemplate] = dict()
+        # (template name, cache key) => (subject, encoded body)
+        self.cache: 'OrderedDict[Any, Tuple[str, bytes]]' = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def register(self,
+                 name: str,
+                 subject: str,
+                 text: str) -> None:
+        "Parse and pre-wrap a template. Replaces one with the same name."
+        template = MessageTemplate(subject, text, self.wrap_width)
+        with self.__lock:
+            self.templates[name] = template
+            # Entries of a replaced template must not be used anymore:
+            self.cache.clear()
+
+    def render(self,
+               name: str,
+               variables: Dict[str, Any]) -> Tuple[str, str]:
+        "Return subject and wrapped text."
+        try:
+            template = self.templates[name]
+        except KeyError as unknown:
+            raise ValueError(f"Unknown template '{name}'!") from unknown
+        subject, wrapped_text = template.render(variables)
+        if subject == '':
+            raise err.MissingSubject(
+                'Mails without subject will likely be classified as spam.')
+        if wrapped_text == '':
+            raise err.MissingMailContent('No mail content supplied.')
+        return subject, wrapped_text
+
+    def render_encoded(self,
+                       name: str,
+                       variables: Dict[str, Any]) -> Tuple[str, bytes]:
+        """Return subject and the body as encoded by
+           message.encode_body. Results are cached (see
+           MessageTemplate.cache_key)."""
+        try:
+            template = self.templates[name]
+        except KeyError as unknown:
+            raise ValueError(f"Unknown template '{name}'!") from unknown
+        key: Any = None
+        if self.cache_size:
+            key = (name, template.cache_key(variables))
+        if key is not None:
+            with self.__lock:
+                cached = self.cache.get(key, None)
+                if cached is not None:
+                    self.cache.move_to_end(key)
+                    return cached
+        subject, wrapped_text = self.render(name, variables)
+        rendered = (subject, message.encode_body(wrapped_text))
+        if key is not None:
+            with self.__lock:
+                self.cache[key] = rendered
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        return rendered
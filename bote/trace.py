@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Bote: Trace mode
+
+Records how long each stage of send_mail takes (validate, wrap, build,
+smtp) and how many bytes wrapping and building the message produced.
+The spans are kept in a ring buffer and can be exported as JSON or as a
+stats file that pstats / snakeviz can read.
+
+Enable it with the setting 'trace': True or the environment variable
+BOTE_TRACE=1.
+
+Source: https://github.com/RuedigerVoigt/bote
+(c) 2020-2021 Rüdiger Voigt:
+Released under the Apache License 2.0
+"""
+
+from collections import deque
+import json
+import marshal
+import os
+import time
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+# A span: (stage, start, duration in seconds, size in bytes or None)
+Span = Tuple[str, float, float, Optional[int]]
+
+DEFAULT_MAX_SPANS = 10000
+
+
+def enabled_by_environment() -> bool:
+    "True if the environment variable BOTE_TRACE is set to a true value."
+    return os.environ.get('BOTE_TRACE', '').lower() in ('1', 'true', 'yes')
+
+
+class Tracer:
+    """Collect timing spans in a ring buffer. Only the latest max_spans
+       spans are kept, so memory use is bounded."""
+
+    def __init__(self,
+                 max_spans: int = DEFAULT_MAX_SPANS):
+        if not isinstance(max_spans, int) or max_spans < 1:
+            raise ValueError('max_spans must be a positive integer!')
+        # deque.append is thread-safe, so no lock is needed:
+        self.spans: Deque[Span] = deque(maxlen=max_spans)
+
+    @staticmethod
+    def clock() -> float:
+        "Start time for the next span."
+        return time.perf_counter()
+
+    def span(self,
+             stage: str,
+             start: float,
+             size: Optional[int] = None) -> float:
+        "Record a span that started at start. Return the current time."
+        now = time.perf_counter()
+        self.spans.append((stage, start, now - start, size))
+        return now
+
+    def clear(self) -> None:
+        "Drop all recorded spans."
+        self.spans.clear()
+
+    def to_list(self) -> List[Dict[str, Any]]:
+        "Return the recorded spans as a list of dictionaries."
+        return [{'stage': stage, 'start': start,
+                 'duration': duration, 'size': size}
+                for stage, start, duration, size in list(self.spans)]
+
+    def export_json(self,
+                    path: str) -> None:
+        "Write the recorded spans into a JSON file."
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(self.to_list(), file)
+
+    def export_pstats(self,
+                      path: str) -> None:
+        """Write the recorded spans as a stats file in the format of
+           cProfile. Load it with pstats.Stats(path). Every stage is
+           a function called by send_mail."""
+        stats: Dict[Tuple[str, int, str], Any] = dict()
+        totals: Dict[str, List[Any]] = dict()
+        for stage, _, duration, _ in list(self.spans):
+            calls_time = totals.setdefault(stage, [0, 0.0])
+            calls_time[0] += 1
+            calls_time[1] += duration
+        parent = ('bote', 0, 'send_mail')
+        for stage, (calls, seconds) in totals.items():
+            if stage == 'send_mail':
+                continue
+            # (primitive calls, calls, own time, cumulative time, callers)
+            stats[('bote', 0, stage)] = (
+                calls, calls, seconds, seconds,
+                {parent: (calls, calls, seconds, seconds)})
+        if 'send_mail' in totals:
+            calls, seconds = totals['send_mail']
+            own_time = seconds - sum(
+                stage_total[1] for stage, stage_total in totals.items()
+                if stage != 'send_mail')
+            stats[parent] = (calls, calls, max(own_time, 0.0), seconds, {})
+        with open(path, 'wb') as file:
+            marshal.dump(stats, file)
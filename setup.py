@@ -22,6 +22,7 @@ setuptools.setup(
     python_requires=">=3.6",
     install_requires=["compatibility>=1.0.1",
                       "userprovided>=0.9.4"],
+    entry_points={"console_scripts": ["bote=bote.cli:main"]},
     classifiers=[
         "Programming Language :: Python :: 3",
         "Programming Language :: Python :: 3.6",
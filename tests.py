@@ -13,8 +13,19 @@ Source: https://github.com/RuedigerVoigt/bote
 (c) 2020-2021 Rüdiger Voigt
 Released under the Apache License 2.0
 """
+import datetime
+import decimal
+import email
+import io
+import json
+from email.message import EmailMessage
+import email.policy
 import logging
+import os
+import pstats
 import smtplib
+import threading
+import time
 from unittest.mock import patch
 
 
@@ -22,6 +33,17 @@ import pytest
 import bote
 
 
+@pytest.fixture(autouse=True)
+def empty_connection_pool():
+    """Do not let tests reuse (mocked) connections of other tests and
+       restore limits changed by a test (the CLI sets max_size)."""
+    default_pool = bote.pool.default_pool
+    limits = (default_pool.max_size, default_pool.max_messages,
+              default_pool.idle_timeout)
+    yield
+    default_pool.close_all()
+    default_pool.configure(*limits)
+
 # #############################################################################
 # TEST MISSING AND INVALID PARAMETERS
 # #############################################################################
@@ -456,3 +478,579 @@ def test_send_mail_GENERIC(caplog):
         with pytest.raises(Exception):
             mailer.send_mail('random subject', 'random content')
         assert "Problem sending mail" in caplog.text
+
+
+# #############################################################################
+# TEST MESSAGE BUILDER
+# #############################################################################
+
+
+def _parse(msg_bytes):
+    # Messages are sent with CRLF, but the parser expects native line endings
+    return email.message_from_bytes(msg_bytes.replace(b'\r\n', b'\n'),
+                                    policy=email.policy.default)
+
+
+def test_message_builder_equivalent_to_emailmessage():
+    builder = bote.message.MessageBuilder(
+        'bar@example.com', {'default': 'foo@example.com'})
+    for subject, text in (
+            ('random subject', 'random content\n'),
+            ('Grüße ' * 20, 'Grüße\nwith = sign and trailing space \n'),
+            ('random subject', 'x' * 100 + '\n.leading dot\n')):
+        reference = EmailMessage()
+        reference.set_content(text)
+        reference['Subject'] = subject
+        reference['From'] = 'bar@example.com'
+        reference['To'] = 'foo@example.com'
+        reference = _parse(reference.as_bytes())
+
+        msg_bytes = builder.build('foo@example.com', subject, text)
+        assert b'\r\n\r\n' in msg_bytes
+        assert b'\n' not in msg_bytes.replace(b'\r\n', b'')
+        parsed = _parse(msg_bytes)
+        for header in ('Subject', 'From', 'To', 'Content-Type'):
+            assert parsed[header] == reference[header]
+        assert parsed.get_content() == reference.get_content()
+        assert parsed['Date'] is not None
+        assert parsed['Message-ID'].endswith('@example.com>')
+
+
+def test_message_builder_header_cache():
+    builder = bote.message.MessageBuilder(
+        'bar@example.com',
+        {'default': 'foo@example.com', 'admin': 'admin@example.com'})
+    assert set(builder.header_blocks) == {'foo@example.com',
+                                          'admin@example.com'}
+    # Addresses outside the routing table are not cached
+    msg_bytes = builder.build('other@example.com', 'subject', 'text')
+    assert b'To: other@example.com\r\n' in msg_bytes
+    assert 'other@example.com' not in builder.header_blocks
+
+
+def test_message_builder_header_injection():
+    builder = bote.message.MessageBuilder(
+        'bar@example.com', {'default': 'foo@example.com'})
+    with pytest.raises(ValueError):
+        builder.build('foo@example.com', 'subject\r\nBcc: x@example.com',
+                      'text')
+
+
+def test_send_mail_uses_sendmail(mocker):
+    mocked_smtp = mocker.patch('smtplib.SMTP')
+    mailer = bote.Mailer(false_but_valid_mail_settings)
+    mailer.send_mail('random subject', 'random content')
+    smtp = mocked_smtp.return_value
+    sender, recipients, msg_bytes = smtp.sendmail.call_args[0]
+    assert sender == 'bar@example.com'
+    assert recipients == ['foo@example.com']
+    assert _parse(msg_bytes).get_content() == 'random content\n'
+
+
+# #############################################################################
+# TEST COMMAND-LINE INTERFACE
+# #############################################################################
+
+
+def test_cli_read_settings(tmp_path, monkeypatch):
+    config_file = tmp_path / 'bote.ini'
+    config_file.write_text(
+        "[bote]\nserver = smtp.example.com\nserver_port = 587\n"
+        "encryption = starttls\nsender = bar@example.com\n"
+        "[recipient]\ndefault = foo@example.com\nadmin = admin@example.com\n")
+    monkeypatch.setenv('BOTE_USERNAME', 'exampleuser')
+    monkeypatch.setenv('BOTE_SERVER_PORT', '465')
+    settings = bote.cli.read_settings(str(config_file))
+    assert settings['server_port'] == 465
+    assert settings['username'] == 'exampleuser'
+    assert settings['recipient'] == {'default': 'foo@example.com',
+                                     'admin': 'admin@example.com'}
+    monkeypatch.setenv('BOTE_WRAP_WIDTH', 'foo')
+    with pytest.raises(ValueError) as excinfo:
+        bote.cli.read_settings(str(config_file))
+    assert 'wrap_width must be an integer' in str(excinfo.value)
+
+
+def test_cli_batch_send(tmp_path, monkeypatch, capsys, mocker):
+    for key, value in false_but_valid_mail_settings.items():
+        monkeypatch.setenv(f"BOTE_{key.upper()}", str(value))
+    send_mail = mocker.patch('bote.Mailer.send_mail')
+    input_file = tmp_path / 'messages.jsonl'
+    input_file.write_text(
+        '{"subject": "s1", "text": "t1"}\n'
+        '\n'
+        '{"subject": "s2", "text": "t2", "recipient": "x@example.com"}\n')
+    assert bote.cli.main(['--input', str(input_file), '--workers', '2']) == 0
+    assert bote.pool.default_pool.max_size == 2
+    assert send_mail.call_count == 2
+    send_mail.assert_any_call('s2', 't2', 'x@example.com')
+    assert '2 sent, 0 failed' in capsys.readouterr().err
+
+
+def test_cli_batch_send_failures(monkeypatch, capsys, mocker):
+    for key, value in false_but_valid_mail_settings.items():
+        monkeypatch.setenv(f"BOTE_{key.upper()}", str(value))
+    send_mail = mocker.patch(
+        'bote.Mailer.send_mail',
+        side_effect=smtplib.SMTPServerDisconnected('gone'))
+    monkeypatch.setattr('sys.stdin', io.TextIOWrapper(io.BytesIO(
+        'not json\n{"subject": "Grüße", "text": "t"}\n'.encode('utf-8')),
+        encoding='latin-1'))
+    assert bote.cli.main([]) == 1
+    send_mail.assert_called_once_with('Grüße', 't', None)
+    stderr = capsys.readouterr().err
+    assert 'line 1: JSONDecodeError' in stderr
+    assert 'line 2: SMTPServerDisconnected' in stderr
+    assert '0 sent, 2 failed' in stderr
+
+
+def test_cli_invalid_utf8(tmp_path, monkeypatch, capsys, mocker):
+    for key, value in false_but_valid_mail_settings.items():
+        monkeypatch.setenv(f"BOTE_{key.upper()}", str(value))
+    send_mail = mocker.patch('bote.Mailer.send_mail')
+    input_file = tmp_path / 'messages.jsonl'
+    input_file.write_bytes(
+        b'{"subject": "s1", "text": "t1"}\n'
+        b'\xff\xfe bad\n'
+        b'{"subject": "s3", "text": "t3"}\n')
+    assert bote.cli.main(['--input', str(input_file)]) == 1
+    # The lines around the invalid one are sent anyway:
+    assert send_mail.call_count == 2
+    stderr = capsys.readouterr().err
+    assert 'line 2: UnicodeDecodeError' in stderr
+    assert '2 sent, 1 failed' in stderr
+
+
+def test_cli_invalid_settings(monkeypatch, capsys):
+    monkeypatch.setenv('BOTE_SENDER', 'not_an_email')
+    monkeypatch.setenv('BOTE_RECIPIENT', 'foo@example.com')
+    assert bote.cli.main([]) == 2
+    assert 'sender is not a valid email' in capsys.readouterr().err
+
+
+# #############################################################################
+# TEST QUEUED MESSAGES
+# #############################################################################
+
+
+def test_queued_message(mocker):
+    mail_settings = dict(false_but_valid_mail_settings)
+    mail_settings['recipient'] = {'default': 'foo@example.com',
+                                  'admin': 'admin@example.com'}
+    mailer = bote.Mailer(mail_settings)
+    text = 'The crawler finished its job.\n' * 20
+    plain = mailer.queue_message('random subject', text, 'admin')
+    compressed = mailer.queue_message('random subject', text, 'admin',
+                                      compress=True)
+    assert not hasattr(plain, '__dict__')
+    assert plain.subject is compressed.subject
+    assert compressed.compressed is True
+    assert len(compressed.body) < len(plain.body)
+    assert compressed.encoded_body() == plain.body
+    # Compression is skipped if it does not save space:
+    assert mailer.queue_message('s', 'x', compress=True).compressed is False
+
+    msg = mailer.to_email_message(compressed)
+    assert msg['To'] == 'admin@example.com'
+    assert msg['Subject'] == 'random subject'
+    assert msg.get_content() == text
+
+    mocked_smtp = mocker.patch('smtplib.SMTP')
+    mailer.send_queued_message(compressed)
+    smtp = mocked_smtp.return_value
+    _, recipients, msg_bytes = smtp.sendmail.call_args[0]
+    assert recipients == ['admin@example.com']
+    assert _parse(msg_bytes).get_content() == text
+
+
+def test_queued_message_invalid():
+    mailer = bote.Mailer(false_but_valid_mail_settings)
+    with pytest.raises(ValueError) as excinfo:
+        mailer.queue_message('random subject', 'random content', 'admin')
+    assert 'Unknown recipient role' in str(excinfo.value)
+    with pytest.raises(bote.err.MissingSubject):
+        mailer.queue_message('', 'random content')
+    with pytest.raises(bote.err.MissingMailContent):
+        mailer.queue_message('random subject', '')
+    with pytest.raises(ValueError):
+        mailer.queue_message('subject\nBcc: x@example.com', 'text')
+
+
+# #############################################################################
+# TEST CONNECTION POOL
+# #############################################################################
+
+
+def test_pool_shared_by_mailers(mocker):
+    mocked_smtp = mocker.patch('smtplib.SMTP')
+    mailer = bote.Mailer(false_but_valid_mail_settings)
+    other_settings = dict(false_but_valid_mail_settings)
+    other_settings['recipient'] = {'default': 'other@example.com'}
+    other_mailer = bote.Mailer(other_settings)
+    mailer.send_mail('random subject', 'random content')
+    other_mailer.send_mail('random subject', 'random content')
+    # One connection with one login for both mailers:
+    assert mocked_smtp.call_count == 1
+    assert mocked_smtp.return_value.login.call_count == 1
+    assert mocked_smtp.return_value.sendmail.call_count == 2
+    # A different username needs its own connection:
+    other_settings['username'] = 'otheruser'
+    bote.Mailer(other_settings).send_mail('random subject', 'content')
+    assert mocked_smtp.call_count == 2
+
+
+def test_pool_not_shared_with_other_passphrase(mocker):
+    mocked_smtp = mocker.patch('smtplib.SMTP')
+    bote.Mailer(false_but_valid_mail_settings).send_mail('subject', 'text')
+    wrong_passphrase = dict(false_but_valid_mail_settings)
+    wrong_passphrase['passphrase'] = 'wrong'
+    mailer = bote.Mailer(wrong_passphrase)
+    assert mailer.pool_key != bote.Mailer(
+        false_but_valid_mail_settings).pool_key
+    assert 'wrong' not in str(mailer.pool_key)
+    # The session of the other Mailer is not reused, so login() runs:
+    mailer.send_mail('subject', 'text')
+    assert mocked_smtp.call_count == 2
+    mocked_smtp.return_value.login.assert_called_with(
+        'exampleuser', 'wrong')
+
+
+def test_pool_message_limit(mocker):
+    connections = [mocker.Mock(), mocker.Mock()]
+    connect = mocker.Mock(side_effect=connections)
+    connection_pool = bote.pool.ConnectionPool(max_messages=2,
+                                               idle_timeout=60)
+    key = ('smtp.example.com', 587, 'starttls', 'exampleuser', None)
+    for _ in range(3):
+        connection_pool.send(key, connect, 'a@example.com',
+                             ['b@example.com'], b'msg')
+    # The first connection was closed after two messages:
+    assert connect.call_count == 2
+    connections[0].quit.assert_called_once()
+    connections[1].quit.assert_not_called()
+    connection_pool.close_all()
+    connections[1].quit.assert_called_once()
+
+
+def test_pool_idle_eviction_without_further_sends(mocker):
+    connection = mocker.Mock()
+    connection_pool = bote.pool.ConnectionPool(idle_timeout=0.1)
+    key = ('smtp.example.com', 587, 'starttls', 'exampleuser', None)
+    connection_pool.send(key, mocker.Mock(return_value=connection),
+                         'a@example.com', ['b@example.com'], b'msg')
+    connection.quit.assert_not_called()
+    # Nothing is sent anymore, but the reaper closes the connection:
+    time.sleep(0.5)
+    connection.quit.assert_called_once()
+    # The next send opens a new connection:
+    new_connection = mocker.Mock()
+    connection_pool.configure(idle_timeout=60)
+    connection_pool.send(key, mocker.Mock(return_value=new_connection),
+                         'a@example.com', ['b@example.com'], b'msg')
+    new_connection.sendmail.assert_called_once()
+    connection_pool.close_all()
+
+
+def test_pool_retry_stale_connection(mocker):
+    stale, fresh = mocker.Mock(), mocker.Mock()
+    stale.sendmail.side_effect = [None, smtplib.SMTPServerDisconnected]
+    connect = mocker.Mock(side_effect=[stale, fresh])
+    connection_pool = bote.pool.ConnectionPool()
+    key = ('localhost', None, 'off', None, None)
+    for _ in range(2):
+        connection_pool.send(key, connect, 'a@example.com',
+                             ['b@example.com'], b'msg')
+    fresh.sendmail.assert_called_once()
+    # A new connection that fails is not retried:
+    fresh.sendmail.side_effect = smtplib.SMTPServerDisconnected
+    connection_pool.close_all()
+    connect.side_effect = [fresh]
+    with pytest.raises(smtplib.SMTPServerDisconnected):
+        connection_pool.send(key, connect, 'a@example.com',
+                             ['b@example.com'], b'msg')
+
+
+def test_pool_retry_after_421(mocker):
+    timed_out, fresh = mocker.Mock(), mocker.Mock()
+    timed_out.sendmail.side_effect = [
+        None,
+        smtplib.SMTPSenderRefused(421, b'Timeout', 'a@example.com')]
+    connect = mocker.Mock(side_effect=[timed_out, fresh])
+    connection_pool = bote.pool.ConnectionPool()
+    key = ('localhost', None, 'off', None, None)
+    for _ in range(2):
+        connection_pool.send(key, connect, 'a@example.com',
+                             ['b@example.com'], b'msg')
+    fresh.sendmail.assert_called_once()
+    # Other codes and 421 on a new connection are errors:
+    fresh.sendmail.side_effect = smtplib.SMTPSenderRefused(
+        550, b'No', 'a@example.com')
+    with pytest.raises(smtplib.SMTPSenderRefused):
+        connection_pool.send(key, connect, 'a@example.com',
+                             ['b@example.com'], b'msg')
+    refusing = mocker.Mock()
+    refusing.sendmail.side_effect = smtplib.SMTPSenderRefused(
+        421, b'Busy', 'a@example.com')
+    connect.side_effect = [refusing]
+    with pytest.raises(smtplib.SMTPSenderRefused):
+        connection_pool.send(key, connect, 'a@example.com',
+                             ['b@example.com'], b'msg')
+
+
+def test_pool_max_size(mocker):
+    connection_pool = bote.pool.ConnectionPool(max_size=1)
+    key = ('localhost', None, 'off', None, None)
+    connect = mocker.Mock()
+    connection, reused = connection_pool.acquire(key, connect)
+    assert reused is False
+    released = threading.Event()
+
+    def release_later():
+        time.sleep(0.1)
+        released.set()
+        connection_pool.release(key, connection)
+    threading.Thread(target=release_later).start()
+    # Blocks until the other thread released the only connection:
+    same_connection, reused = connection_pool.acquire(key, connect)
+    assert released.is_set()
+    assert reused is True and same_connection is connection
+    assert connect.call_count == 1
+    with pytest.raises(ValueError):
+        connection_pool.configure(max_size=0)
+
+
+def test_pool_fork(mocker):
+    connection_pool = bote.pool.ConnectionPool()
+    key = ('localhost', None, 'off', None, None)
+    parent_connection = mocker.Mock()
+    connection_pool.send(key, mocker.Mock(return_value=parent_connection),
+                         'a@example.com', ['b@example.com'], b'msg')
+    # Pretend to be a child process:
+    mocker.patch('os.getpid', return_value=os.getpid() + 1)
+    child_connection = mocker.Mock()
+    connection_pool.send(key, mocker.Mock(return_value=child_connection),
+                         'a@example.com', ['b@example.com'], b'msg')
+    child_connection.sendmail.assert_called_once()
+    assert parent_connection.sendmail.call_count == 1
+    parent_connection.quit.assert_not_called()
+
+
+# #############################################################################
+# TEST TRACE MODE
+# #############################################################################
+
+
+def test_trace_mode(mocker, tmp_path):
+    mocker.patch('smtplib.SMTP')
+    mailer = bote.Mailer(false_but_valid_mail_settings)
+    assert mailer.tracer is None
+    mail_settings = dict(false_but_valid_mail_settings)
+    mail_settings['trace'] = True
+    mailer = bote.Mailer(mail_settings)
+    mailer.send_mail('random subject', 'random content')
+    spans = mailer.tracer.to_list()
+    assert [span['stage'] for span in spans] == [
+        'validate', 'wrap', 'build', 'smtp', 'send_mail']
+    assert spans[1]['size'] == len('random content\n')
+    assert spans[2]['size'] > spans[1]['size']
+    # Failed mails are traced as well:
+    with pytest.raises(bote.err.MissingSubject):
+        mailer.send_mail('', 'random content')
+    assert mailer.tracer.to_list()[-1]['stage'] == 'send_mail'
+
+    json_file = tmp_path / 'trace.json'
+    mailer.tracer.export_json(str(json_file))
+    assert len(json.loads(json_file.read_text())) == 6
+    stats_file = tmp_path / 'trace.prof'
+    mailer.tracer.export_pstats(str(stats_file))
+    stats = pstats.Stats(str(stats_file))
+    assert stats.stats[('bote', 0, 'send_mail')][1] == 2
+    assert stats.stats[('bote', 0, 'smtp')][1] == 1
+
+
+def test_trace_mode_settings(monkeypatch):
+    monkeypatch.setenv('BOTE_TRACE', '1')
+    assert bote.Mailer(false_but_valid_mail_settings).tracer is not None
+    mail_settings = dict(false_but_valid_mail_settings)
+    mail_settings['trace'] = False
+    assert bote.Mailer(mail_settings).tracer is None
+    mail_settings['trace'] = 'yes'
+    with pytest.raises(ValueError) as excinfo:
+        bote.Mailer(mail_settings)
+    assert 'trace must be True or False' in str(excinfo.value)
+
+
+def test_trace_ring_buffer():
+    tracer = bote.trace.Tracer(max_spans=3)
+    for _ in range(5):
+        tracer.span('build', tracer.clock(), 10)
+    assert len(tracer.to_list()) == 3
+    tracer.clear()
+    assert tracer.to_list() == []
+    with pytest.raises(ValueError):
+        bote.trace.Tracer(max_spans=0)
+
+
+# #############################################################################
+# TEST TEMPLATES
+# #############################################################################
+
+
+def test_send_template_equivalent_to_send_mail(mocker):
+    mail_settings = dict(false_but_valid_mail_settings)
+    mail_settings['wrap_width'] = 30
+    mailer = bote.Mailer(mail_settings)
+    subject = 'Job {job} failed'
+    text = ('A long static line that has to be wrapped at thirty chars.\n'
+            '\n'
+            'Job {job} failed with: {error} {{escaped}}\n'
+            'Static {{braces}}')
+    variables = {'job': 42, 'error': 'disk full\nand a second line ' * 3}
+    mailer.register_template('failure', subject, text)
+    assert mailer.templates.templates['failure'].lines[0] == (
+        False, 'A long static line that has to\nbe wrapped at thirty chars.\n')
+
+    deliver = mocker.patch('bote.Mailer._Mailer__deliver')
+    mailer.send_template('failure', **variables)
+    mailer.send_mail(subject.format(**variables), text.format(**variables))
+    from_template = _parse(deliver.call_args_list[0][0][1])
+    from_send_mail = _parse(deliver.call_args_list[1][0][1])
+    assert from_template['Subject'] == from_send_mail['Subject']
+    assert from_template.get_content() == from_send_mail.get_content()
+
+    mailer.send_template('failure', 'admin@example.com', **variables)
+    assert deliver.call_args[0][0] == 'admin@example.com'
+
+    # An empty variable or one ending with a line break keeps all lines:
+    mailer.register_template('head_tail', 'subject', 'Head\n{x}\nTail')
+    for x, expected in (('', 'Head\n\nTail\n'),
+                        ('foo\n', 'Head\nfoo\n\nTail\n')):
+        assert mailer.templates.render('head_tail', {'x': x})[1] == expected
+        mailer.send_template('head_tail', x=x)
+        mailer.send_mail('subject', 'Head\n{x}\nTail'.format(x=x))
+        from_template = _parse(deliver.call_args_list[-2][0][1])
+        from_send_mail = _parse(deliver.call_args_list[-1][0][1])
+        assert from_template.get_content() == expected
+        assert from_template.get_content() == from_send_mail.get_content()
+
+
+def test_template_render_cache(mocker):
+    mailer = bote.Mailer(false_but_valid_mail_settings)
+    mocker.patch('bote.Mailer._Mailer__deliver')
+    mailer.register_template('alert', 'Alert {level}', 'Level: {level}')
+    render = mocker.spy(bote.template.MessageTemplate, 'render')
+    mailer.send_template('alert', level=1)
+    mailer.send_template('alert', level=1)
+    assert render.call_count == 1
+    # 1 and True are equal, but render differently:
+    mailer.send_template('alert', level=True)
+    assert render.call_count == 2
+    # Other values are cached by what they format to:
+    mailer.send_template('alert', level=[1])
+    mailer.send_template('alert', level=[1])
+    assert render.call_count == 3
+    # Replacing a template empties the cache:
+    mailer.register_template('alert', 'Alert {level}', 'New: {level}')
+    assert len(mailer.templates.cache) == 0
+
+    registry = bote.template.TemplateRegistry(80, cache_size=2)
+    registry.register('alert', 'Alert {level}', 'Level: {level}')
+    for level in range(3):
+        registry.render_encoded('alert', {'level': level})
+    assert len(registry.cache) == 2
+
+
+def test_template_render_cache_equal_values():
+    # Values that are equal, but format differently, must not share
+    # a cache entry:
+    registry = bote.template.TemplateRegistry(80)
+    registry.register('alert', 'Alert', 'Value: {value}')
+    pairs = (
+        (decimal.Decimal('1.0'), decimal.Decimal('1.00')),
+        (datetime.datetime(2021, 1, 1, 13, 0, tzinfo=datetime.timezone(
+            datetime.timedelta(hours=1))),
+         datetime.datetime(2021, 1, 1, 12, 0, tzinfo=datetime.timezone.utc)),
+        (0.0, -0.0))
+    for first, second in pairs:
+        assert first == second
+        _, first_body = registry.render_encoded('alert', {'value': first})
+        _, second_body = registry.render_encoded('alert', {'value': second})
+        assert str(first).encode('ascii') in first_body
+        assert str(second).encode('ascii') in second_body
+    # The format spec is part of the key:
+    registry.register('money', 'Alert', 'Sum: {value:.1f}')
+    _, body = registry.render_encoded('money', {'value': 1.0})
+    _, same_body = registry.render_encoded('money', {'value': 1.04})
+    assert body == same_body
+    assert len(registry.cache) == 1
+
+
+def test_template_invalid(mocker):
+    mailer = bote.Mailer(false_but_valid_mail_settings)
+    with pytest.raises(ValueError) as excinfo:
+        mailer.register_template('positional', 'Alert {}', 'text')
+    assert 'only support named fields' in str(excinfo.value)
+    with pytest.raises(ValueError):
+        mailer.register_template('positional', 'Alert', 'text {0}')
+    for reserved in ('template_name', 'overwrite_recipient'):
+        with pytest.raises(ValueError) as excinfo:
+            mailer.register_template('reserved', 'Alert', f"{{{reserved}}}")
+        assert 'cannot be used as a template field' in str(excinfo.value)
+    with pytest.raises(ValueError):
+        mailer.register_template('reserved', '{template_name.x}', 'text')
+    with pytest.raises(bote.err.MissingSubject):
+        mailer.register_template('no_subject', '', 'text')
+    with pytest.raises(bote.err.MissingMailContent):
+        mailer.register_template('no_text', 'subject', '')
+    with pytest.raises(ValueError) as excinfo:
+        mailer.send_template('unknown')
+    assert "Unknown template 'unknown'" in str(excinfo.value)
+    mailer.register_template('alert', '{subject}', '{text}')
+    with pytest.raises(KeyError):
+        mailer.send_template('alert', subject='s')
+    with pytest.raises(bote.err.MissingSubject):
+        mailer.send_template('alert', subject='', text='t')
+    with pytest.raises(bote.err.MissingMailContent):
+        mailer.send_template('alert', subject='s', text='')
+    with pytest.raises(ValueError):
+        mailer.send_template('alert', 'not_valid', subject='s', text='t')
+
+
+def test_message_builder_invalid_roles(mocker):
+    mail_settings = dict(false_but_valid_mail_settings)
+    mail_settings['recipient'] = {'default': 'foo@example.com',
+                                  'admin': None,
+                                  'evil': 'x@example.com\nBcc: y@example.com'}
+    # Invalid roles do not fail when the Mailer is created ...
+    mailer = bote.Mailer(mail_settings)
+    assert set(mailer.message_builder.header_blocks) == {'foo@example.com'}
+    mocker.patch('smtplib.SMTP')
+    mailer.send_mail('random subject', 'random content')
+    # ... but when a mail is sent to them:
+    with pytest.raises(ValueError):
+        mailer.send_mail('random subject', 'random content',
+                         mail_settings['recipient']['evil'])
+
+
+def test_send_mail_logs_build_errors(caplog):
+    mailer = bote.Mailer(false_but_valid_mail_settings)
+    with pytest.raises(ValueError):
+        mailer.send_mail('subject\r\nBcc: x@example.com', 'random content')
+    assert "Problem sending mail" in caplog.text
+
+
+def test_queued_message_other_mailer(mocker):
+    mail_settings = dict(false_but_valid_mail_settings)
+    mail_settings['recipient'] = {'default': 'foo@example.com',
+                                  'admin': 'admin@example.com'}
+    queued = bote.Mailer(mail_settings).queue_message(
+        'random subject', 'random content', 'admin')
+    # This Mailer has only one role, so index 1 does not exist:
+    other_mailer = bote.Mailer(false_but_valid_mail_settings)
+    mocked_smtp = mocker.patch('smtplib.SMTP')
+    with pytest.raises(ValueError) as excinfo:
+        other_mailer.send_queued_message(queued)
+    assert 'not in the routing table' in str(excinfo.value)
+    with pytest.raises(ValueError):
+        other_mailer.to_email_message(queued)
+    mocked_smtp.return_value.sendmail.assert_not_called()